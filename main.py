@@ -1,15 +1,28 @@
 import os
 import re
+import string
+import asyncio
+import functools
+import hashlib
 import uuid
-import requests
-from fastapi import FastAPI, Form, UploadFile
-from fastapi.responses import JSONResponse
+import httpx
+import ahocorasick
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+import cv2
+import numpy as np
+from fastapi import BackgroundTasks, FastAPI, Form, UploadFile
+from fastapi.responses import ORJSONResponse, Response
 from paddleocr import PaddleOCR
-import psycopg2
+from paddleocr.tools.infer.predict_system import sorted_boxes
+from paddleocr.tools.infer.utility import get_minarea_rect_crop, get_rotate_crop_image
+import asyncpg
 from twilio.rest import Client
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 from twilio.base.exceptions import TwilioRestException
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import date, datetime
+from contextlib import asynccontextmanager
 import logging
 
 load_dotenv()
@@ -18,67 +31,351 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "16"))
+
+# Invoice rows saved within this window are written together with a single COPY
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "100"))
+DB_BATCH_WINDOW = float(os.getenv("DB_BATCH_WINDOW_MS", "50")) / 1000
+# Smaller batches use the prepared INSERT, which avoids COPY's per-call setup
+DB_COPY_MIN_ROWS = int(os.getenv("DB_COPY_MIN_ROWS", "10"))
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 
+# Optional Redis used to short-circuit retried webhooks for the same media
+REDIS_URL = os.getenv("REDIS_URL")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+# Upper bound on one webhook run. The in-progress claim outlives it by a safety margin, so
+# a retry can only take over the media once the original run has finished or been abandoned
+WEBHOOK_PROCESSING_TIMEOUT = int(os.getenv("WEBHOOK_PROCESSING_TIMEOUT_SECONDS", "60"))
+IDEMPOTENCY_PROCESSING_TTL = WEBHOOK_PROCESSING_TIMEOUT + 30
+
+# OCR model location (baked by download_models.py), device and precision selection
+OCR_MODELS_DIR = os.getenv("OCR_MODELS_DIR", "/models")
+OCR_USE_GPU = os.getenv("OCR_USE_GPU", "false").lower() in ("1", "true", "yes")
+OCR_USE_INT8 = os.getenv("OCR_USE_INT8", "false").lower() in ("1", "true", "yes")
+
+# Concurrent OCR requests arriving within this window are recognised as one batch
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+OCR_BATCH_WINDOW = float(os.getenv("OCR_BATCH_WINDOW_MS", "10")) / 1000
+
+# Shared PostgreSQL pool, HTTP/Redis clients and batching tasks, started on startup (see lifespan)
+_PG_POOL = None
+_HTTP_CLIENT = None
+_REDIS = None
+_OCR_BATCHER = None
+_INVOICE_WRITER = None
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Open shared resources when the app starts and release them on shutdown.
+    """
+    global _PG_POOL, _HTTP_CLIENT, _REDIS, _OCR_BATCHER, _INVOICE_WRITER
+    _PG_POOL = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=DB_POOL_MAX_SIZE)
+    logger.info(f"Opened database connection pool (max {DB_POOL_MAX_SIZE} connections)")
+    # Twilio media URLs redirect to the storage backend, so follow redirects
+    _HTTP_CLIENT = httpx.AsyncClient(timeout=30, follow_redirects=True)
+    if REDIS_URL:
+        _REDIS = aioredis.from_url(REDIS_URL)
+    else:
+        logger.warning("REDIS_URL not set, duplicate webhook detection is disabled")
+    _OCR_BATCHER = asyncio.create_task(ocr_batcher())
+    _INVOICE_WRITER = asyncio.create_task(invoice_writer())
+    try:
+        yield
+    finally:
+        _OCR_BATCHER.cancel()
+        _INVOICE_WRITER.cancel()
+        await _HTTP_CLIENT.aclose()
+        if _REDIS is not None:
+            await _REDIS.aclose()
+        if _twilio_client.cache_info().currsize:
+            await _twilio_client().http_client.close()
+        await _PG_POOL.close()
+        logger.info("Closed database connection pool")
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+def create_ocr_engine():
+    """
+    Build the PaddleOCR engine, preferring the exported ONNX models so inference runs
+    through onnxruntime (on CUDAExecutionProvider when OCR_USE_GPU is set). On CPU the
+    INT8 quantized models are used only when OCR_USE_INT8 is enabled; CUDA always runs
+    the FP32 export since the quantized integer kernels are CPU-only. Falls back to the baked
+    Paddle inference models (or PaddleOCR's defaults) when no ONNX export is available.
+    
+    Returns:
+        PaddleOCR: Initialized OCR engine
+    """
+    variants = ["onnx"] if OCR_USE_GPU or not OCR_USE_INT8 else ["quantized", "onnx"]
+    
+    for variant in variants:
+        onnx_models = {
+            name: os.path.join(OCR_MODELS_DIR, variant, f"{name}.onnx")
+            for name in ("det", "rec", "cls")
+        }
+        if not all(os.path.exists(path) for path in onnx_models.values()):
+            continue
+        
+        logger.info(f"Loading {variant} OCR models from {OCR_MODELS_DIR} (GPU: {OCR_USE_GPU})")
+        return PaddleOCR(
+            use_angle_cls=False,
+            lang='en',
+            use_onnx=True,
+            use_gpu=OCR_USE_GPU,
+            det_model_dir=onnx_models["det"],
+            rec_model_dir=onnx_models["rec"],
+            cls_model_dir=onnx_models["cls"]
+        )
+    
+    logger.warning(f"ONNX OCR models not found in {OCR_MODELS_DIR}, using Paddle inference models")
+    paddle_models = {
+        f"{name}_model_dir": os.path.join(OCR_MODELS_DIR, "paddle", name)
+        for name in ("det", "rec", "cls")
+    }
+    if not all(os.path.isdir(path) for path in paddle_models.values()):
+        paddle_models = {}
+    return PaddleOCR(use_angle_cls=False, lang='en', use_gpu=OCR_USE_GPU, **paddle_models)
+
 # Initialize PaddleOCR engine
-ocr_engine = PaddleOCR(use_angle_cls=False, lang='en')
+ocr_engine = create_ocr_engine()
 
-def extract_invoice_data(text):
+async def collect_batch(queue, max_size, window):
+    """
+    Wait for the next queued item, then keep collecting items that arrive within
+    the window, up to max_size.
+    
+    Args:
+        queue (asyncio.Queue): Queue to consume
+        max_size (int): Maximum number of items in the batch
+        window (float): Seconds to wait for more items after the first one
+    
+    Returns:
+        list: Between 1 and max_size queued items
+    """
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + window
+    while len(batch) < max_size:
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), deadline - loop.time()))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+# Pending OCR work as (image, future) pairs. A single batching task consumes it, which
+# also keeps the non-thread-safe PaddleOCR predictors to one worker thread at a time
+_OCR_QUEUE = asyncio.Queue()
+
+def ocr_batch(images):
+    """
+    Run OCR over several images in one pass. Text detection runs per image (inputs
+    differ in size), then the text crops from all images go through the recognizer
+    together so its fixed-height batches stay full.
+    
+    Args:
+        images (list): BGR image arrays
+    
+    Returns:
+        list: For each image, a list of [box, (text, score)] lines (empty if no text found)
+    """
+    crops, boxes, owners = [], [], []
+    for index, image in enumerate(images):
+        dt_boxes, _ = ocr_engine.text_detector(image)
+        if dt_boxes is None or len(dt_boxes) == 0:
+            continue
+        
+        for box in sorted_boxes(dt_boxes):
+            if ocr_engine.args.det_box_type == "quad":
+                crops.append(get_rotate_crop_image(image, box.copy()))
+            else:
+                crops.append(get_minarea_rect_crop(image, box.copy()))
+            boxes.append(box)
+            owners.append(index)
+    
+    results = [[] for _ in images]
+    if not crops:
+        return results
+    
+    if ocr_engine.use_angle_cls:
+        crops, _, _ = ocr_engine.text_classifier(crops)
+    rec_res, _ = ocr_engine.text_recognizer(crops)
+    
+    # Same confidence filter PaddleOCR applies in its own pipeline
+    for index, box, (text, score) in zip(owners, boxes, rec_res):
+        if score >= ocr_engine.drop_score:
+            results[index].append([box.tolist(), (text, score)])
+    
+    return results
+
+async def ocr_batcher():
+    """
+    Background task that coalesces queued OCR requests arriving within OCR_BATCH_WINDOW
+    (up to OCR_BATCH_SIZE) and runs them through ocr_batch in a worker thread.
+    If a batch fails, each image is re-run on its own so the error only reaches the
+    request whose image caused it.
+    """
+    while True:
+        batch = await collect_batch(_OCR_QUEUE, OCR_BATCH_SIZE, OCR_BATCH_WINDOW)
+        
+        logger.info(f"Running OCR batch of {len(batch)} image(s)")
+        try:
+            results = await asyncio.to_thread(ocr_batch, [image for image, _ in batch])
+        except Exception as e:
+            logger.warning(f"OCR batch failed ({e}), retrying images individually")
+            for image, future in batch:
+                try:
+                    lines, = await asyncio.to_thread(ocr_batch, [image])
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(lines)
+            continue
+        
+        for (_, future), lines in zip(batch, results):
+            if not future.done():
+                future.set_result(lines)
+
+async def run_ocr(image):
+    """
+    Queue an image for the OCR batcher and wait for its result.
+    
+    Args:
+        image (numpy.ndarray): BGR image array
+    
+    Returns:
+        list: [box, (text, score)] lines recognized in the image
+    """
+    future = asyncio.get_running_loop().create_future()
+    await _OCR_QUEUE.put((image, future))
+    return await future
+
+# Invoice parsing patterns, compiled once at import. They are written in lowercase and
+# run against a lowercased copy of the text instead of using re.IGNORECASE.
+# Each family is a single alternation so the OCR text is scanned once per field.
+_INVOICE_RE = re.compile(
+    r'(?:invoice\s*(?:no\.?|number|#)'
+    r'|inv\s*(?:no\.?|#)'
+    r'|bill\s*(?:no\.?|number|#)'
+    r'|reference\s*(?:no\.?|number|#))'
+    r'\s*:?\s*([a-z0-9\-]+)'
+)
+
+# Total Amount (with various currency symbols and formatting); the amount is
+# captured by group 1 for label-first text and group 2 for currency-first text
+_AMOUNT_RE = re.compile(
+    r'(?:total\s*(?:amount)?'
+    r'|amount\s*(?:due|total)?'
+    r'|grand\s*total'
+    r'|balance\s*(?:due)?)'
+    r'\s*:?\s*[$£€₹]?\s*([0-9,]+\.?\d*)'
+    r'|[$£€₹]\s*([0-9,]+\.?\d*)\s*(?:total|due|balance)'
+)
+
+# Due Date (various formats); captures the two day/month fields, the separator
+# (which must repeat) and the year so no further date-format parsing is needed
+_DATE_RE = re.compile(
+    r'(?:due\s*(?:date|by|on)?'
+    r'|payment\s*due'
+    r'|payable\s*by)'
+    r'\s*:?\s*(\d{1,2})([\/\-\.])(\d{1,2})\2(\d{2,4})'
+)
+
+# ASCII-only lowercasing, used when str.lower() would change the text's length
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Keywords that every pattern in a field family needs, mapped to the families they
+# anchor. One Aho-Corasick pass over the text tells which families can match at all.
+_FIELD_KEYWORD_FAMILIES = {
+    "inv": ("invoice",),
+    "bill": ("invoice",),
+    "reference": ("invoice",),
+    "total": ("amount",),
+    "amount": ("amount",),
+    "balance": ("amount",),
+    "due": ("amount", "date"),
+    "payable": ("date",),
+}
+
+def _build_field_keywords():
+    """
+    Build the Aho-Corasick automaton over _FIELD_KEYWORD_FAMILIES.
+    
+    Returns:
+        ahocorasick.Automaton: Automaton yielding the families anchored by each keyword
+    """
+    automaton = ahocorasick.Automaton()
+    for keyword, families in _FIELD_KEYWORD_FAMILIES.items():
+        automaton.add_word(keyword, families)
+    automaton.make_automaton()
+    return automaton
+
+_FIELD_KEYWORDS = _build_field_keywords()
+
+def decode_image(data):
+    """
+    Decode downloaded media bytes into an image array that PaddleOCR accepts directly.
+    
+    Args:
+        data (bytes): Raw media file contents
+    
+    Returns:
+        numpy.ndarray: BGR image, or None if the bytes are not a supported image format
+    """
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+@functools.lru_cache(maxsize=512)
+def parse_invoice_text(text):
     """
     Intelligent invoice parser using regular expressions to extract:
     - Invoice ID/Number
     - Total Amount
     - Due Date
     
+    The result depends only on the text, so it is memoized; resending the same
+    invoice skips the regex scans entirely.
+    
     Args:
         text (str): Raw text extracted from OCR
         
     Returns:
-        tuple: (invoice_id, total_amount, due_date)
+        tuple: (invoice_id, total_amount, due_date), with None for any field not found
     """
-    logger.info("Starting invoice data extraction from OCR text")
-    
     # Initialize default values
     invoice_id = None
     total_amount = None
     due_date = None
     
-    # Patterns for Invoice ID/Number (case-insensitive)
-    invoice_patterns = [
-        r'invoice\s*(?:no\.?|number|#)\s*:?\s*([A-Z0-9\-]+)',
-        r'inv\s*(?:no\.?|#)\s*:?\s*([A-Z0-9\-]+)',
-        r'bill\s*(?:no\.?|number|#)\s*:?\s*([A-Z0-9\-]+)',
-        r'reference\s*(?:no\.?|number|#)\s*:?\s*([A-Z0-9\-]+)'
-    ]
-    
-    # Search for invoice ID
-    for pattern in invoice_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            invoice_id = match.group(1).strip()
-            logger.info(f"Found invoice ID: {invoice_id}")
+    # Lowercase once for the patterns. Match positions must line up with the original
+    # text, so fall back to ASCII-only lowercasing if lower() changed the length
+    text_lc = text.lower()
+    if len(text_lc) != len(text):
+        text_lc = text.translate(_ASCII_LOWER)
+    
+    # Find which field families have their anchor keywords in the text, stopping
+    # early once all three are present
+    families = set()
+    for _, matched in _FIELD_KEYWORDS.iter(text_lc):
+        families.update(matched)
+        if len(families) == 3:
             break
     
-    # Patterns for Total Amount (with various currency symbols and formatting)
-    amount_patterns = [
-        r'total\s*(?:amount)?\s*:?\s*[$£€₹]?\s*([0-9,]+\.?\d*)',
-        r'amount\s*(?:due|total)?\s*:?\s*[$£€₹]?\s*([0-9,]+\.?\d*)',
-        r'grand\s*total\s*:?\s*[$£€₹]?\s*([0-9,]+\.?\d*)',
-        r'balance\s*(?:due)?\s*:?\s*[$£€₹]?\s*([0-9,]+\.?\d*)',
-        r'[$£€₹]\s*([0-9,]+\.?\d*)\s*(?:total|due|balance)'
-    ]
-    
-    # Search for total amount
-    for pattern in amount_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    # Search for invoice ID, keeping its original case
+    if "invoice" in families:
+        match = _INVOICE_RE.search(text_lc)
         if match:
+            invoice_id = text[match.start(1):match.end(1)].strip()
+            logger.info(f"Found invoice ID: {invoice_id}")
+    
+    # Search for total amount, skipping candidates that don't parse (e.g. a lone comma)
+    if "amount" in families:
+        for match in _AMOUNT_RE.finditer(text_lc):
             # Clean amount string (remove commas, convert to float)
-            amount_str = match.group(1).replace(',', '')
+            amount_str = (match.group(1) or match.group(2)).replace(',', '')
             try:
                 total_amount = float(amount_str)
                 logger.info(f"Found total amount: {total_amount}")
@@ -86,29 +383,45 @@ def extract_invoice_data(text):
             except ValueError:
                 continue
     
-    # Patterns for Due Date (various formats)
-    date_patterns = [
-        r'due\s*(?:date|by)?\s*:?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-        r'payment\s*due\s*:?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-        r'payable\s*by\s*:?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-        r'due\s*on\s*:?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})'
-    ]
-    
     # Search for due date
-    for pattern in date_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            date_str = match.group(1)
-            # Try to parse different date formats
-            for fmt in ['%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y', '%m-%d-%Y', '%d.%m.%Y', '%m.%d.%Y']:
+    if "date" in families:
+        for match in _DATE_RE.finditer(text_lc):
+            first, _, second, year_str = match.groups()
+            if len(year_str) == 3:
+                continue
+            first, second, year = int(first), int(second), int(year_str)
+            if year < 100:
+                year += 2000
+            
+            # Day-first, falling back to month-first when the day/month don't fit
+            try:
+                due_date = date(year, second, first)
+            except ValueError:
                 try:
-                    due_date = datetime.strptime(date_str, fmt).date()
-                    logger.info(f"Found due date: {due_date}")
-                    break
+                    due_date = date(year, first, second)
                 except ValueError:
                     continue
-            if due_date:
-                break
+            
+            logger.info(f"Found due date: {due_date}")
+            break
+    
+    return invoice_id, total_amount, due_date
+
+def extract_invoice_data(text):
+    """
+    Parse invoice fields from OCR text, filling in fallback values for anything missing.
+    Fallbacks are applied outside the parser cache so every invoice gets a fresh
+    generated ID and today's date rather than a cached one.
+    
+    Args:
+        text (str): Raw text extracted from OCR
+        
+    Returns:
+        tuple: (invoice_id, total_amount, due_date)
+    """
+    logger.info("Starting invoice data extraction from OCR text")
+    
+    invoice_id, total_amount, due_date = parse_invoice_text(text)
     
     # Fallback values if extraction fails
     if not invoice_id:
@@ -125,7 +438,77 @@ def extract_invoice_data(text):
     
     return invoice_id, total_amount, due_date
 
-def save_invoice(invoice_number, total_amount, due_date, sender_whatsapp):
+# Pending invoice rows as (row, future) pairs, written in batches by invoice_writer
+_INVOICE_QUEUE = asyncio.Queue()
+_INVOICE_COLUMNS = ("invoice_number", "total_amount", "due_date", "sender_whatsapp")
+_INSERT_SQL = """
+    INSERT INTO invoices (invoice_number, total_amount, due_date, sender_whatsapp)
+    VALUES ($1, $2, $3, $4)
+"""
+
+async def invoice_writer():
+    """
+    Background task that collects invoice rows saved within DB_BATCH_WINDOW (up to
+    DB_BATCH_SIZE) and writes them in one COPY, replacing a round-trip and commit per row.
+    Batches below DB_COPY_MIN_ROWS go through the prepared INSERT instead: asyncpg caches
+    prepared statements per connection, so it is parsed and planned once per pooled
+    connection and each flush only binds and executes it.
+    Each row's future is resolved once its batch has been committed. Both paths are
+    atomic, so if the server rejects a batch nothing was written: its rows are retried one
+    INSERT at a time and only the rows that fail again get the error.
+    """
+    while True:
+        batch = await collect_batch(_INVOICE_QUEUE, DB_BATCH_SIZE, DB_BATCH_WINDOW)
+        
+        logger.info(f"Writing batch of {len(batch)} invoice(s) to database")
+        rows = [row for row, _ in batch]
+        try:
+            async with _PG_POOL.acquire() as conn:
+                if len(rows) >= DB_COPY_MIN_ROWS:
+                    await conn.copy_records_to_table("invoices", records=rows, columns=_INVOICE_COLUMNS)
+                else:
+                    await conn.executemany(_INSERT_SQL, rows)
+        except asyncpg.PostgresError as e:
+            logger.warning(f"Invoice batch rejected ({e}), retrying rows individually")
+            await write_invoices_individually(batch)
+            continue
+        except Exception as e:
+            # Connection-level failures may hit after the batch committed, so re-inserting
+            # the rows could duplicate them
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+async def write_invoices_individually(batch):
+    """
+    Insert the rows of a failed batch one at a time, so a single bad row only fails
+    its own future.
+    
+    Args:
+        batch (list): (row, future) pairs from the failed batch
+    """
+    try:
+        async with _PG_POOL.acquire() as conn:
+            for row, future in batch:
+                try:
+                    await conn.execute(_INSERT_SQL, *row)
+                except asyncpg.PostgresError as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(None)
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+async def save_invoice(invoice_number, total_amount, due_date, sender_whatsapp):
     """
     Save invoice data to PostgreSQL database with comprehensive error handling.
     
@@ -140,29 +523,35 @@ def save_invoice(invoice_number, total_amount, due_date, sender_whatsapp):
     """
     try:
         logger.info(f"Attempting to save invoice {invoice_number} to database")
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        cur.execute("""
-            INSERT INTO invoices (invoice_number, total_amount, due_date, sender_whatsapp)
-            VALUES (%s, %s, %s, %s)
-        """, (invoice_number, total_amount, due_date, sender_whatsapp))
         
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Queue the row for the batched writer and wait until it has been committed
+        future = asyncio.get_running_loop().create_future()
+        await _INVOICE_QUEUE.put(((invoice_number, total_amount, due_date, sender_whatsapp), future))
+        await future
         
         logger.info(f"Successfully saved invoice {invoice_number} to database")
         return True
         
-    except psycopg2.Error as e:
+    except asyncpg.PostgresError as e:
         logger.error(f"Database error while saving invoice {invoice_number}: {str(e)}")
         return False
     except Exception as e:
         logger.error(f"Unexpected error while saving invoice {invoice_number}: {str(e)}")
         return False
 
-def send_confirmation(to, invoice_number):
+@functools.lru_cache(maxsize=1)
+def _twilio_client():
+    """
+    Return a shared Twilio client so its HTTP session (and keep-alive connection
+    to api.twilio.com) is reused across webhooks. Built lazily on first use so a
+    missing credential doesn't prevent the app from starting.
+    
+    Returns:
+        Client: Twilio REST client backed by the async HTTP client
+    """
+    return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=AsyncTwilioHttpClient())
+
+async def send_confirmation(to, invoice_number):
     """
     Send confirmation message via Twilio WhatsApp API with error handling.
     
@@ -175,10 +564,10 @@ def send_confirmation(to, invoice_number):
     """
     try:
         logger.info(f"Sending confirmation message for invoice {invoice_number} to {to}")
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        client = _twilio_client()
         message = f"✅ Invoice {invoice_number} has been processed successfully and saved to our system."
         
-        result = client.messages.create(
+        result = await client.messages.create_async(
             body=message,
             from_=TWILIO_PHONE_NUMBER,
             to=to
@@ -194,7 +583,7 @@ def send_confirmation(to, invoice_number):
         logger.error(f"Unexpected error while sending confirmation for invoice {invoice_number}: {str(e)}")
         return False
 
-def send_error_message(to, error_text):
+async def send_error_message(to, error_text):
     """
     Send error message to user via Twilio WhatsApp API when processing fails.
     
@@ -207,12 +596,12 @@ def send_error_message(to, error_text):
     """
     try:
         logger.info(f"Sending error message to {to}: {error_text}")
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        client = _twilio_client()
         
         # Create a user-friendly error message with helpful guidance
         message = f"❌ {error_text}\n\n💡 Tips for better results:\n• Ensure the image is clear and well-lit\n• Avoid shadows or glare\n• Make sure all text is visible\n• Try taking the photo from directly above the document"
         
-        result = client.messages.create(
+        result = await client.messages.create_async(
             body=message,
             from_=TWILIO_PHONE_NUMBER,
             to=to
@@ -228,32 +617,139 @@ def send_error_message(to, error_text):
         logger.error(f"Unexpected error while sending error message to {to}: {str(e)}")
         return False
 
+async def claim_media(media_url):
+    """
+    Claim a media URL in Redis so retried webhooks for it are not processed twice.
+    
+    Args:
+        media_url (str): URL of the media file from Twilio
+    
+    Returns:
+        tuple: (claim, prior) where claim is the (key, token) pair to record the outcome with
+            (None if not claimed or Redis is unavailable) and prior is the stored response body
+            of an earlier successful run, or b"" if that run is still in progress
+    """
+    if _REDIS is None:
+        return None, None
+    
+    key = "inv:" + hashlib.sha1(media_url.encode()).hexdigest()
+    # Per-run token, so a run only ever releases or promotes its own claim
+    token = uuid.uuid4().hex
+    try:
+        if await _REDIS.set(key, token, nx=True, ex=IDEMPOTENCY_PROCESSING_TTL):
+            return (key, token), None
+        prior = await _REDIS.get(key + ":result")
+        return None, prior or b""
+    except RedisError as e:
+        logger.warning(f"Redis unavailable, processing {media_url} without duplicate check: {str(e)}")
+        return None, None
+
+# Compare-and-set/delete scripts: the claim is only touched while it still holds this
+# run's token, so a run that lost its claim cannot clobber the run that took it over
+_PROMOTE_CLAIM_LUA = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[3])
+    redis.call("SET", KEYS[2], ARGV[2], "EX", ARGV[3])
+    return 1
+end
+return 0
+"""
+_RELEASE_CLAIM_LUA = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+async def record_media_result(claim, response):
+    """
+    Store a successful response for a claimed media URL and keep the claim for the full
+    IDEMPOTENCY_TTL, or release the claim on failure so the media can be processed again.
+    Nothing is written if the claim no longer holds this run's token.
+    
+    Args:
+        claim (tuple): (key, token) pair returned by claim_media
+        response (Response): Response produced for the media, or None if the run did not finish
+    """
+    key, token = claim
+    try:
+        if response is not None and response.status_code == 200:
+            owned = await _REDIS.eval(
+                _PROMOTE_CLAIM_LUA, 2, key, key + ":result", token, response.body, IDEMPOTENCY_TTL
+            )
+        else:
+            owned = await _REDIS.eval(_RELEASE_CLAIM_LUA, 1, key, token)
+        if not owned:
+            logger.warning(f"Claim {key} expired or was taken over before the run finished")
+    except RedisError as e:
+        logger.warning(f"Failed to record webhook result in Redis: {str(e)}")
+
 @app.post("/api/whatsapp/webhook")
 async def whatsapp_webhook(
+    background_tasks: BackgroundTasks,
     MediaUrl0: str = Form(None),
     From: str = Form(...)
 ):
     """
-    WhatsApp webhook endpoint for processing invoice media with comprehensive error handling
-    and concurrency safety through unique file naming.
+    WhatsApp webhook endpoint for processing invoice media with comprehensive error handling.
+    Retries for media that was already processed (or is being processed) are answered from
+    Redis without repeating the download, OCR, database write and confirmation.
     
     Args:
+        background_tasks (BackgroundTasks): Tasks run after the response is sent
         MediaUrl0 (str): URL of the media file from Twilio
         From (str): Sender's WhatsApp number
     
     Returns:
-        JSONResponse: Success or error response
+        ORJSONResponse: Success or error response
     """
     logger.info(f"Received webhook from {From} with MediaUrl0: {MediaUrl0}")
     
     # Check if media is provided
     if not MediaUrl0:
         logger.warning(f"No media URL provided in webhook from {From}")
-        return JSONResponse({"error": "No media found in the message."}, status_code=400)
+        return ORJSONResponse({"error": "No media found in the message."}, status_code=400)
+    
+    claim, prior = await claim_media(MediaUrl0)
+    if prior is not None:
+        logger.info(f"Duplicate webhook for {MediaUrl0}, skipping processing")
+        if prior:
+            return Response(content=prior, media_type="application/json")
+        return ORJSONResponse({"status": "processing", "message": "Invoice is already being processed"}, status_code=202)
+    
+    # Record the outcome even if processing raised, timed out or was cancelled, so an
+    # unfinished run releases its claim instead of answering retries with "processing".
+    # The timeout keeps every run shorter than its claim's IDEMPOTENCY_PROCESSING_TTL.
+    response = None
+    try:
+        response = await asyncio.wait_for(
+            process_invoice_media(MediaUrl0, From, background_tasks),
+            timeout=WEBHOOK_PROCESSING_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"Processing {MediaUrl0} exceeded {WEBHOOK_PROCESSING_TIMEOUT}s, giving up")
+        response = ORJSONResponse(
+            {"error": "Processing took too long. Please try again later."},
+            status_code=504
+        )
+    finally:
+        if claim is not None:
+            await record_media_result(claim, response)
+    return response
+
+async def process_invoice_media(MediaUrl0, From, background_tasks):
+    """
+    Download, OCR, parse and save an invoice, notifying the sender of the outcome.
+    Media is decoded and OCR'd in memory, so concurrent requests share no temporary files.
     
-    # Generate unique filename to prevent race conditions
-    unique_filename = f"/tmp/invoice_{uuid.uuid4().hex}.file"
+    Args:
+        MediaUrl0 (str): URL of the media file from Twilio
+        From (str): Sender's WhatsApp number
+        background_tasks (BackgroundTasks): Tasks run after the response is sent
     
+    Returns:
+        ORJSONResponse: Success or error response
+    """
     try:
         # Download media file with error handling
         logger.info(f"Downloading media from: {MediaUrl0}")
@@ -261,69 +757,68 @@ async def whatsapp_webhook(
         # Ensure Twilio credentials are available for authentication
         if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
             logger.error("Twilio credentials not found in environment variables")
-            return JSONResponse(
+            return ORJSONResponse(
                 {"error": "Server configuration error. Please contact support."}, 
                 status_code=500
             )
         
-        response = requests.get(
+        response = await _HTTP_CLIENT.get(
             MediaUrl0,
-            auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
-            timeout=30
+            auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
         )
         response.raise_for_status()  # Raises an HTTPError for bad responses
         
-        # Save the downloaded file
-        with open(unique_filename, "wb") as f:
-            f.write(response.content)
-        
-        logger.info(f"Media file saved as: {unique_filename}")
+        # Decode the image in memory instead of round-tripping through a temp file
+        image = await asyncio.to_thread(decode_image, response.content)
+        logger.info(f"Downloaded {len(response.content)} bytes of media")
         
-        # Perform OCR with error handling
+        # Perform OCR with error handling, batched with other concurrent webhooks
         logger.info("Starting OCR processing")
-        result = ocr_engine.ocr(unique_filename)
+        if image is None:
+            logger.error("Downloaded media could not be decoded as an image")
+            lines = None
+        else:
+            lines = await run_ocr(image)
         
-        if not result or not result[0]:
+        if not lines:
             logger.error("OCR failed to extract any text from the image")
             
             # Send user-friendly error message to WhatsApp
             error_text = "I couldn't read any text from your document. Please try sending a clearer image of your invoice."
-            send_error_message(From, error_text)
+            await send_error_message(From, error_text)
             
-            return JSONResponse(
+            return ORJSONResponse(
                 {"error": "Could not extract text from the image. Please ensure the image is clear and contains readable text."}, 
                 status_code=400
             )
         
         # Extract text from OCR results
-        text = " ".join([line[1][0] for line in result[0] if line[1][0]])
+        text = " ".join(line_text for _, (line_text, _score) in lines if line_text)
         logger.info(f"OCR extracted text: {text[:100]}...")  # Log first 100 chars
         
         # Parse invoice data using intelligent parser
         invoice_id, total_amount, due_date = extract_invoice_data(text)
         
         # Save to database
-        db_success = save_invoice(invoice_id, total_amount, due_date, From)
+        db_success = await save_invoice(invoice_id, total_amount, due_date, From)
         if not db_success:
             logger.error(f"Failed to save invoice {invoice_id} to database")
             
             # Notify user about database error
             error_text = "There was a technical issue saving your invoice. Please try again in a few minutes."
-            send_error_message(From, error_text)
+            await send_error_message(From, error_text)
             
-            return JSONResponse(
+            return ORJSONResponse(
                 {"error": "Failed to save invoice data to database. Please try again later."}, 
                 status_code=500
             )
         
-        # Send confirmation message
-        confirmation_success = send_confirmation(From, invoice_id)
-        if not confirmation_success:
-            logger.warning(f"Invoice {invoice_id} saved but confirmation message failed to send")
-            # Don't return error here as the main operation (saving invoice) succeeded
+        # Send confirmation message after the response has gone out; a failure is logged
+        # by send_confirmation and doesn't affect the result since the invoice is saved
+        background_tasks.add_task(send_confirmation, From, invoice_id)
         
         logger.info(f"Successfully processed invoice {invoice_id} from {From}")
-        return JSONResponse({
+        return ORJSONResponse({
             "status": "success", 
             "invoice_id": invoice_id,
             "total_amount": total_amount,
@@ -331,14 +826,14 @@ async def whatsapp_webhook(
             "message": "Invoice processed successfully"
         })
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Failed to download media from {MediaUrl0}: {str(e)}")
         
         # Notify user about download failure
         error_text = "I couldn't download your document. Please try sending it again."
-        send_error_message(From, error_text)
+        await send_error_message(From, error_text)
         
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": "Failed to download the media file. Please check the file and try again."}, 
             status_code=400
         )
@@ -347,17 +842,9 @@ async def whatsapp_webhook(
         
         # Notify user about unexpected error
         error_text = "Something unexpected happened while processing your invoice. Please try again later."
-        send_error_message(From, error_text)
+        await send_error_message(From, error_text)
         
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": "An unexpected error occurred while processing your invoice. Please try again later."}, 
             status_code=500
         )
-    finally:
-        # Always clean up the temporary file to prevent storage issues
-        try:
-            if os.path.exists(unique_filename):
-                os.remove(unique_filename)
-                logger.info(f"Cleaned up temporary file: {unique_filename}")
-        except Exception as e:
-            logger.warning(f"Failed to clean up temporary file {unique_filename}: {str(e)}")